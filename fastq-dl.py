@@ -1,15 +1,26 @@
 #! /usr/bin/env python3
 import argparse
+import csv
+import errno
+import functools
 import hashlib
+import io
 import json
 import logging
 import os
+import queue
+import shutil
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.request import urlopen
 from uuid import uuid4
 
 import requests
+from urllib3.util.retry import Retry
 from executor import ExternalCommand, ExternalCommandFailed
 
 PROGRAM = "fastq-dl"
@@ -20,11 +31,28 @@ ENA_FAILED = "ENA_NOT_FOUND"
 SRA_FAILED = "SRA_NOT_FOUND"
 MB = 1_048_576
 BUFFER_SIZE = 10 * MB
+DOWNLOAD_TIMEOUT = 600
+CACHE_TTL = 86_400
+ARIA2C_MAX_CONNECTIONS = 16
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    ),
+)
 logging.addLevelName(STDOUT, "STDOUT")
 logging.addLevelName(STDERR, "STDERR")
 
+QUERY_PREFIXES = {"RR": "run_accession", "RX": "experiment_accession"}
 ENA_URL = "https://www.ebi.ac.uk/ena/portal/api/search?result=read_run&format=tsv"
-FIELDS = [
+FIELDS = (
     "study_accession",
     "secondary_study_accession",
     "sample_accession",
@@ -76,7 +104,8 @@ FIELDS = [
     "sample_title",
     "nominal_sdev",
     "first_created",
-]
+)
+ENA_URL_TEMPLATE = ENA_URL + '&query="{}"&fields=' + ",".join(FIELDS)
 
 
 def set_log_level(error, debug):
@@ -91,7 +120,7 @@ def get_log_level():
 
 def execute(
     cmd,
-    directory=os.getcwd(),
+    directory=None,
     capture_stdout=False,
     stdout_file=None,
     stderr_file=None,
@@ -103,13 +132,15 @@ def execute(
     while attempt < max_attempts:
         attempt += 1
         try:
+            # Without a directory, the command runs in the current working directory
+            options = {"directory": directory} if directory else {}
             command = ExternalCommand(
                 cmd,
-                directory=directory,
                 capture=True,
                 capture_stderr=True,
                 stdout_file=stdout_file,
                 stderr_file=stderr_file,
+                **options,
             )
 
             command.start()
@@ -137,45 +168,84 @@ def execute(
                 raise error
 
 
+@functools.lru_cache(maxsize=1)
+def sratools_configured(ncbi_user):
+    """Check if the sra-toolkit user settings include a UUID."""
+    return "/LIBS/GUID" in Path(ncbi_user).read_text()
+
+
 def check_sratools():
     """Check whether the use has completed the interactive step for sra-toolkit."""
-    needs_setup = False
     home = Path(os.environ["HOME"])
     ncbi_home = home / ".ncbi"
     ncbi_user = ncbi_home / "user-settings.mkfg"
+    if ncbi_user.exists() and sratools_configured(ncbi_user):
+        return
+
     if not ncbi_home.exists():
         logging.info(f'\tDirectory "{ncbi_home}" not found, setting up.')
-        ncbi_home.mkdir(parents=True)
-        needs_setup = True
+        ncbi_home.mkdir(parents=True, exist_ok=True)
     elif not ncbi_user.exists():
         logging.info(f'\tFile "{ncbi_user}" not found, setting up.')
-        needs_setup = True
     else:
-        with open(ncbi_user, "rt") as ncbi_fh:
-            uuid_found = False
-            for line in ncbi_fh:
-                if "/LIBS/GUID" in line:
-                    uuid_found = True
-        if not uuid_found:
-            needs_setup = True
-            logging.info(f'\tUUID not found in "{ncbi_user}", setting up.')
-
-    if needs_setup:
-        uuid = str(uuid4())
-        ncbi_user.touch()
-        with open(ncbi_user, "a") as ncbi_fh:
-            ncbi_fh.write(f'/LIBS/GUID = "{uuid}"\n')
-        logging.info(f"\tAdded randomly generated UUID to {ncbi_user}")
-
-
-def sra_download(accession, outdir, cpus=1, max_attempts=10):
+        logging.info(f'\tUUID not found in "{ncbi_user}", setting up.')
+
+    # Write to a temporary file and move it into place, so parallel downloads
+    # never see a partially written settings file
+    uuid = str(uuid4())
+    settings = ncbi_user.read_text() if ncbi_user.exists() else ""
+    if settings and not settings.endswith("\n"):
+        settings += "\n"
+    tmp_user = ncbi_home / f".{ncbi_user.name}.{uuid}"
+    with open(tmp_user, "x") as ncbi_fh:
+        # Created with the default (umask) permissions, like a new settings file
+        ncbi_fh.write(f'{settings}/LIBS/GUID = "{uuid}"\n')
+    if ncbi_user.exists():
+        shutil.copymode(ncbi_user, tmp_user)
+    os.replace(tmp_user, ncbi_user)
+    logging.info(f"\tAdded randomly generated UUID to {ncbi_user}")
+    sratools_configured.cache_clear()
+
+
+def compress_fastqs(fq_files, outdir, cpus=1):
+    """Compress FASTQs with pigz, one pigz per file at the same time if cpus allow."""
+    pigz = "pigz --force -n --fast --independent -b 1024"
+    if cpus < len(fq_files):
+        # Not enough cpus for a pigz per file, compress them one after another
+        execute(f"{pigz} -p {cpus} {' '.join(fq_files)}", directory=outdir)
+    else:
+        threads = cpus // len(fq_files)
+        with ThreadPoolExecutor(max_workers=len(fq_files)) as executor:
+            futures = [
+                executor.submit(
+                    execute, f"{pigz} -p {threads} {fq_file}", directory=outdir
+                )
+                for fq_file in fq_files
+            ]
+            for future in futures:
+                future.result()
+
+
+def list_files(directory):
+    """Return the names of the files in a directory, using a single scan."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
+
+
+def sra_download(accession, outdir, cpus=1, max_attempts=10, existing=None):
     """Download FASTQs from SRA using fasterq-dump."""
     check_sratools()
     fastqs = {"r1": "", "r2": "", "single_end": True}
-    se = f"{outdir}/{accession}.fastq.gz"
-    pe = f"{outdir}/{accession}_2.fastq.gz"
+    if existing is None:
+        existing = list_files(outdir)
 
-    if not os.path.exists(se) and not os.path.exists(pe):
+    if (
+        f"{accession}.fastq.gz" not in existing
+        and f"{accession}_2.fastq.gz" not in existing
+    ):
         Path(outdir).mkdir(parents=True, exist_ok=True)
         outcome = execute(
             f"fasterq-dump {accession} --split-files --threads {cpus}",
@@ -186,9 +256,23 @@ def sra_download(accession, outdir, cpus=1, max_attempts=10):
         if outcome == SRA_FAILED:
             return outcome
         else:
-            execute(f"pigz --force -p {cpus} -n --fast *.fastq", directory=outdir)
+            # Only compress this run's FASTQs, other runs may share the directory
+            fq_files = [
+                f
+                for f in (
+                    f"{accession}.fastq",
+                    f"{accession}_1.fastq",
+                    f"{accession}_2.fastq",
+                )
+                if os.path.exists(f"{outdir}/{f}")
+            ]
+            if fq_files:
+                compress_fastqs(fq_files, outdir, cpus=cpus)
+            is_paired = f"{accession}_2.fastq" in fq_files
+    else:
+        is_paired = f"{accession}_2.fastq.gz" in existing
 
-    if os.path.exists(f"{outdir}/{accession}_2.fastq.gz"):
+    if is_paired:
         # Paired end
         fastqs["r1"] = f"{outdir}/{accession}_1.fastq.gz"
         fastqs["r2"] = f"{outdir}/{accession}_2.fastq.gz"
@@ -199,7 +283,16 @@ def sra_download(accession, outdir, cpus=1, max_attempts=10):
     return fastqs
 
 
-def ena_download(run, outdir, aspera=None, max_attempts=10, ftp_only=False):
+def ena_download(
+    run,
+    outdir,
+    aspera=None,
+    max_attempts=10,
+    ftp_only=False,
+    connections=1,
+    aria2c=None,
+    existing=None,
+):
     fastqs = {"r1": "", "r2": "", "single_end": True}
     fasp = run["fastq_aspera"]
     ftp = run["fastq_ftp"]
@@ -209,6 +302,7 @@ def ena_download(run, outdir, aspera=None, max_attempts=10, ftp_only=False):
     fasp = fasp.split(";")
     ftp = ftp.split(";")
     md5 = run["fastq_md5"].split(";")
+    fastq_bytes = run.get("fastq_bytes", "").split(";")
     for i in range(len(fasp)):
         is_r2 = False
         # If run is paired only include *_1.fastq and *_2.fastq, rarely a
@@ -240,6 +334,10 @@ def ena_download(run, outdir, aspera=None, max_attempts=10, ftp_only=False):
                 aspera,
                 max_attempts=max_attempts,
                 ftp_only=ftp_only,
+                connections=connections,
+                aria2c=aria2c,
+                existing=existing,
+                size=fastq_bytes[i] if i < len(fastq_bytes) else None,
             )
 
             if is_r2:
@@ -251,96 +349,403 @@ def ena_download(run, outdir, aspera=None, max_attempts=10, ftp_only=False):
     return fastqs
 
 
+def new_md5():
+    """Return an MD5 hash object, it is only used to verify downloads."""
+    try:
+        return hashlib.md5(usedforsecurity=False)
+    except TypeError:
+        # usedforsecurity was added in Python 3.9
+        return hashlib.md5()
+
+
 def md5sum(fastq):
     """Return the MD5SUM of an input file.
     Taken from https://stackoverflow.com/a/3431838/5299417
     """
     if os.path.exists(fastq):
-        hash_md5 = hashlib.md5()
         with open(fastq, "rb") as fp:
-            for chunk in iter(lambda: fp.read(BUFFER_SIZE), b""):
-                hash_md5.update(chunk)
+            if sys.version_info >= (3, 11):
+                return hashlib.file_digest(fp, new_md5).hexdigest()
+
+            # Reuse a single buffer, instead of allocating a new chunk per read
+            hash_md5 = new_md5()
+            buffer = bytearray(BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                size = fp.readinto(buffer)
+                if not size:
+                    break
+                hash_md5.update(view[:size])
 
         return hash_md5.hexdigest()
     else:
         return None
 
 
-def download_ena_fastq(fasp, ftp, outdir, md5, aspera, max_attempts=10, ftp_only=False):
+def stream_download_ftp(url, fastq):
+    """Download a file, computing its MD5SUM as it is written to disk.
+
+    Hashing happens in a separate thread, so it overlaps with the download.
+    """
+    hash_md5 = new_md5()
+    free_buffers = queue.Queue()
+    full_buffers = queue.Queue()
+    for _ in range(3):
+        free_buffers.put(bytearray(BUFFER_SIZE))
+
+    def hash_buffers():
+        while True:
+            item = full_buffers.get()
+            if item is None:
+                break
+            buffer, size = item
+            hash_md5.update(memoryview(buffer)[:size])
+            free_buffers.put(buffer)
+
+    hasher = threading.Thread(target=hash_buffers, daemon=True)
+    hasher.start()
+    try:
+        with urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(
+            fastq, "wb"
+        ) as fp:
+            while True:
+                buffer = free_buffers.get()
+                size = response.readinto(buffer)
+                if not size:
+                    break
+                fp.write(memoryview(buffer)[:size])
+                full_buffers.put((buffer, size))
+    finally:
+        full_buffers.put(None)
+        hasher.join()
+
+    return hash_md5.hexdigest()
+
+
+def download_part(url, fd, start, end):
+    """Download a byte range of a file, writing it at the same offset.
+
+    Returns False if the range could not be downloaded.
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    offset = start
+    try:
+        with HTTP_SESSION.get(
+            url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+        ) as r:
+            if r.status_code != requests.codes.partial_content:
+                return False
+            for chunk in r.iter_content(BUFFER_SIZE):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+    except requests.exceptions.RequestException as error:
+        logging.debug(f"Download of bytes {start}-{end} from {url} failed: {error}")
+        return False
+
+    if offset != end + 1:
+        logging.debug(f"Incomplete download of bytes {start}-{end} from {url}")
+        return False
+    return True
+
+
+def range_download(url, fastq, connections):
+    """Download a file using multiple ranged requests at the same time.
+
+    Returns False if the server can not be reached, does not support ranges, or
+    a range fails, so the caller can fall back to a single stream.
+    """
+    try:
+        r = HTTP_SESSION.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException as error:
+        logging.debug(f"Unable to reach {url}: {error}")
+        return False
+
+    size = int(r.headers.get("Content-Length", 0))
+    if (
+        r.status_code != requests.codes.ok
+        or r.headers.get("Accept-Ranges") != "bytes"
+        or size < connections * MB
+    ):
+        return False
+
+    part_size = -(-size // connections)
+    with open(fastq, "wb") as fp:
+        fp.truncate(size)
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [
+                executor.submit(
+                    download_part,
+                    url,
+                    fp.fileno(),
+                    start,
+                    min(start + part_size, size) - 1,
+                )
+                for start in range(0, size, part_size)
+            ]
+            return all(future.result() for future in futures)
+
+
+def rehash(fastq):
+    """Flush a file to disk, then compute its MD5SUM again."""
+    with open(fastq, "rb") as fp:
+        os.fsync(fp.fileno())
+    return md5sum(fastq)
+
+
+def is_verified(fastq, md5):
+    """Check if a previous run already verified the MD5SUM of a file."""
+    md5_file = Path(f"{fastq}.md5")
+    try:
+        if md5_file.stat().st_mtime >= os.path.getmtime(fastq):
+            return md5_file.read_text() == md5
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def remove_md5_file(fastq):
+    """Remove the file recording the verified MD5SUM of a FASTQ, if it exists."""
+    md5_file = Path(f"{fastq}.md5")
+    if md5_file.exists():
+        md5_file.unlink()
+
+
+def download_ena_fastq(
+    fasp,
+    ftp,
+    outdir,
+    md5,
+    aspera,
+    max_attempts=10,
+    ftp_only=False,
+    connections=1,
+    aria2c=None,
+    existing=None,
+    size=None,
+):
     """Download FASTQs from ENA using Apera Connect or FTP."""
     success = False
     attempt = 0
     fastq = f"{outdir}/{os.path.basename(fasp)}"
-
-    if not os.path.exists(fastq):
-        Path(outdir).mkdir(parents=True, exist_ok=True)
-
-        while not success:
-            if ftp_only:
-                logging.info(f"\t\tFTP download attempt {attempt + 1}")
-                execute(
-                    f"wget --quiet -O {fastq} ftp://{ftp}", max_attempts=max_attempts
-                )
+    md5 = md5.strip().lower()
+    md5_file = Path(f"{fastq}.md5")
+    aria2_file = Path(f"{fastq}.aria2")
+    if existing is None:
+        existing = list_files(outdir)
+
+    if os.path.basename(fastq) in existing:
+        if aria2c and ftp_only and f"{os.path.basename(fastq)}.aria2" in existing:
+            # An interrupted aria2c download, leave it for aria2c to resume
+            logging.info(f"\t\tResuming partial download of {fastq}")
+        elif f"{os.path.basename(fastq)}.md5" in existing and is_verified(fastq, md5):
+            return fastq
+        elif md5sum(fastq) == md5:
+            md5_file.write_text(md5)
+            return fastq
+        else:
+            # Likely left over from an interrupted download
+            logging.info(f"\t\t{fastq} does not match its MD5, downloading again")
+            os.remove(fastq)
+            if aria2_file.exists():
+                aria2_file.unlink()
+
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+
+    while not success:
+        resumable = False
+        if ftp_only:
+            logging.info(f"\t\tFTP download attempt {attempt + 1}")
+            if aria2c:
+                connections = min(connections, ARIA2C_MAX_CONNECTIONS)
+                try:
+                    execute(
+                        (
+                            f"{aria2c} --quiet=true -x {connections} "
+                            f"-s {connections} -k 1M --file-allocation=none "
+                            f"--continue=true -o {os.path.basename(fastq)} "
+                            f"ftp://{ftp}"
+                        ),
+                        directory=outdir,
+                        max_attempts=max_attempts,
+                    )
+                    fastq_md5 = md5sum(fastq)
+                except ExternalCommandFailed as error:
+                    logging.error(f"FTP download of {ftp} failed: {error}")
+                    fastq_md5 = None
+                    # Keep the partial download, aria2c continues where it stopped
+                    resumable = True
             else:
-                logging.info(f"\t\tAspera Connect download attempt {attempt + 1}")
-                execute(
-                    (
-                        f'{aspera["ascp"]} -QT -l {aspera["speed"]} -P33001 '
-                        f'-i {aspera["private_key"]} era-fasp@{fasp} ./'
-                    ),
-                    directory=outdir,
-                    max_attempts=max_attempts,
-                )
-
+                try:
+                    fastq_md5 = None
+                    if connections > 1 and range_download(
+                        f"https://{ftp}", fastq, connections
+                    ):
+                        fastq_md5 = md5sum(fastq)
+                    else:
+                        # MD5 is computed while downloading, no need to re-read it
+                        fastq_md5 = stream_download_ftp(f"ftp://{ftp}", fastq)
+                except OSError as error:
+                    logging.error(f"FTP download of {ftp} failed: {error}")
+                    fastq_md5 = None
+        else:
+            logging.info(f"\t\tAspera Connect download attempt {attempt + 1}")
+            execute(
+                (
+                    f'{aspera["ascp"]} -QT -l {aspera["speed"]} -P33001 '
+                    f'-i {aspera["private_key"]} era-fasp@{fasp} ./'
+                ),
+                directory=outdir,
+                max_attempts=max_attempts,
+            )
             fastq_md5 = md5sum(fastq)
-            if fastq_md5 != md5:
-                logging.log(STDOUT, f"MD5s, Observed: {fastq_md5}, Expected: {md5}")
-                attempt += 1
+
+        if fastq_md5 and fastq_md5 != md5:
+            # Hash the file again, before throwing away a possibly good download
+            logging.info(f"\t\tMD5 mismatch for {fastq}, verifying it again")
+            fastq_md5 = rehash(fastq)
+
+        if fastq_md5 != md5:
+            logging.log(STDOUT, f"MD5s, Observed: {fastq_md5}, Expected: {md5}")
+            observed_size = os.path.getsize(fastq) if os.path.exists(fastq) else None
+            logging.log(STDOUT, f"Bytes, Observed: {observed_size}, Expected: {size}")
+            attempt += 1
+            if not resumable:
                 if os.path.exists(fastq):
                     os.remove(fastq)
-                if attempt > max_attempts:
-                    if not ftp_only:
-                        ftp_only = True
-                        attempt = 0
-                    else:
-                        logging.error(
-                            f"Download failed after {max_attempts} attempts. "
-                            "Please try again later or manually from SRA/ENA."
-                        )
-                        sys.exit(1)
-                time.sleep(10)
-            else:
-                success = True
+                if aria2_file.exists():
+                    aria2_file.unlink()
+            if attempt > max_attempts:
+                if not ftp_only:
+                    ftp_only = True
+                    attempt = 0
+                else:
+                    logging.error(
+                        f"Download failed after {max_attempts} attempts. "
+                        "Please try again later or manually from SRA/ENA."
+                    )
+                    sys.exit(1)
+            time.sleep(10)
+        else:
+            success = True
+            md5_file.write_text(md5)
 
     return fastq
 
 
+def append_file(src_fh, dst_fh):
+    """Append the contents of one open file to another."""
+    offset = 0
+    if sys.platform.startswith("linux"):
+        # Let the kernel copy the data, without passing through user space. Only
+        # Linux can sendfile into a regular file, other platforms need a socket.
+        dst_fh.flush()
+        size = os.fstat(src_fh.fileno()).st_size
+        if hasattr(os, "copy_file_range"):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(
+                        src_fh.fileno(), dst_fh.fileno(), size - offset, offset
+                    )
+                    if not copied:
+                        break
+                    offset += copied
+            except OSError:
+                # Kernels before 5.3 can not copy between filesystems
+                pass
+
+        try:
+            while offset < size:
+                sent = os.sendfile(
+                    dst_fh.fileno(), src_fh.fileno(), offset, size - offset
+                )
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            # Copy whatever is left through user space instead
+            pass
+
+    src_fh.seek(offset)
+    shutil.copyfileobj(src_fh, dst_fh, BUFFER_SIZE)
+
+
+def move_file(src, dst):
+    """Move a file, copying it when the destination is on another filesystem."""
+    try:
+        Path(src).rename(dst)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        with open(src, "rb") as src_fh, open(dst, "wb") as dst_fh:
+            append_file(src_fh, dst_fh)
+        Path(src).unlink()
+
+
 def merge_runs(runs, output):
     """Merge runs from an experiment."""
     if len(runs) > 1:
-        run_fqs = " ".join(runs)
-        execute(f"cat {run_fqs} > {output}")
+        # Gzip files can be concatenated, so this is a plain byte copy
+        with open(output, "wb") as out_fh:
+            for p in runs:
+                with open(p, "rb") as run_fh:
+                    append_file(run_fh, out_fh)
         for p in runs:
             Path(p).unlink()
+            remove_md5_file(p)
     else:
-        Path(runs[0]).rename(output)
+        move_file(runs[0], output)
+        remove_md5_file(runs[0])
+
 
+def get_cache_path(query):
+    """Return the path used to cache ENA results for a query."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    key = hashlib.sha256(query.encode()).hexdigest()
+    return Path(cache_home) / PROGRAM / f"{key}.json"
 
-def get_run_info(query):
+
+def get_run_info(query, use_cache=True):
     """Retreive a list of unprocessed samples avalible from ENA."""
-    url = f'{ENA_URL}&query="{query}"&fields={",".join(FIELDS)}'
-    headers = {"Content-type": "application/x-www-form-urlencoded"}
-    r = requests.get(url, headers=headers)
+    cache = get_cache_path(query)
+    if use_cache and cache.exists():
+        if time.time() - cache.stat().st_mtime < CACHE_TTL:
+            logging.debug(f"Using cached ENA results from {cache}")
+            try:
+                with open(cache, "rt") as fh:
+                    return [True, json.load(fh)]
+            except (OSError, ValueError) as error:
+                # A corrupt or unreadable cache is treated as a miss
+                logging.debug(f"Unable to read cached ENA results {cache}: {error}")
+
+    url = ENA_URL_TEMPLATE.format(query)
+    headers = {
+        "Content-type": "application/x-www-form-urlencoded",
+        "Accept-Encoding": "gzip",
+    }
+    try:
+        r = HTTP_SESSION.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException as error:
+        return [False, [None, str(error)]]
     if r.status_code == requests.codes.ok:
-        data = []
-        col_names = None
-        for line in r.text.split("\n"):
-            cols = line.rstrip().split("\t")
-            if line:
-                if col_names:
-                    data.append(dict(zip(col_names, cols)))
-                else:
-                    col_names = cols
+        # csv.reader splits rows in C, the header names are shared by every row
+        reader = csv.reader(io.StringIO(r.text), delimiter="\t", quoting=csv.QUOTE_NONE)
+        col_names = next(reader, [])
+        data = [dict(zip(col_names, cols)) for cols in reader if cols]
+        if not data:
+            # Don't cache empty results, the accession may not be public yet
+            return [True, data]
+
+        try:
+            # Write to a temporary file and move it into place, so processes
+            # running the same query never see a partially written cache
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=cache.parent, delete=False
+            ) as cache_fh:
+                json.dump(data, cache_fh)
+            os.replace(cache_fh.name, cache)
+        except OSError as error:
+            logging.debug(f"Unable to cache ENA results to {cache}: {error}")
         return [True, data]
     else:
         return [False, [r.status_code, r.text]]
@@ -363,12 +768,20 @@ def parse_query(query, is_study, is_experiment, is_run):
         return f"run_accession={query}"
     else:
         # Try to guess...
-        if query[1:3] == "RR":
-            return f"run_accession={query}"
-        elif query[1:3] == "RX":
-            return f"experiment_accession={query}"
-        else:
-            return f"study_accession={query}"
+        return f"{QUERY_PREFIXES.get(query[1:3], 'study_accession')}={query}"
+
+
+def read_accession_list(accession_list):
+    """Read accessions from a file, one per line."""
+    accessions = []
+    with open(accession_list, "rt") as fh:
+        for line in fh:
+            accession = line.strip()
+            if accession and not accession.startswith("#"):
+                accessions.append(accession)
+
+    # Drop duplicates, but keep the order of the file
+    return list(dict.fromkeys(accessions))
 
 
 def check_aspera(ascp, private_key, speed):
@@ -399,6 +812,81 @@ def check_aspera(ascp, private_key, speed):
         return {"ascp": ascp, "private_key": private_key, "speed": speed}
 
 
+def process_run(i, run_info, args, aspera, outdir, existing=None):
+    """Download the FASTQs for a single run, falling back on the other provider."""
+    run_acc = run_info["run_accession"]
+    logging.info(f"\tWorking on run {run_acc}...")
+    fastqs = None
+    error = None
+    # --cpus is the total, share it between the runs downloading at the same time
+    cpus = max(1, args.cpus // args.parallel_downloads)
+    if args.provider == "ena":
+        fastqs = ena_download(
+            run_info,
+            outdir,
+            aspera=aspera,
+            max_attempts=args.max_attempts,
+            ftp_only=args.ftp_only,
+            connections=args.ftp_connections,
+            aria2c=args.aria2c,
+            existing=existing,
+        )
+
+        if fastqs == ENA_FAILED:
+            if args.only_provider:
+                logging.error(f"\tNo fastqs found in ENA for {run_acc}")
+                error = ENA_FAILED
+                fastqs = None
+            else:
+                # Retry download from SRA
+                logging.info(f"\t{run_acc} not found on ENA, retrying from SRA")
+
+                fastqs = sra_download(
+                    run_acc,
+                    outdir,
+                    cpus=cpus,
+                    max_attempts=args.max_attempts,
+                    existing=existing,
+                )
+                if fastqs == SRA_FAILED:
+                    logging.error(f"\t{run_acc} not found on SRA")
+                    error = f"{ENA_FAILED}&{SRA_FAILED}"
+                    fastqs = None
+
+    else:
+        fastqs = sra_download(
+            run_acc,
+            outdir,
+            cpus=cpus,
+            max_attempts=args.max_attempts,
+            existing=existing,
+        )
+        if fastqs == SRA_FAILED:
+            if args.sra_only or args.only_provider:
+                logging.error(f"\t{run_acc} not found on SRA")
+                error = SRA_FAILED
+                fastqs = None
+            else:
+                # Retry download from ENA
+                logging.info(f"\t{run_acc} not found on SRA, retrying from ENA")
+                fastqs = ena_download(
+                    run_info,
+                    outdir,
+                    aspera=aspera,
+                    max_attempts=args.max_attempts,
+                    ftp_only=args.ftp_only,
+                    connections=args.ftp_connections,
+                    aria2c=args.aria2c,
+                    existing=existing,
+                )
+                if fastqs == ENA_FAILED:
+                    logging.error(f"\tNo fastqs found in ENA for {run_acc}")
+                    error = f"{SRA_FAILED}&{ENA_FAILED}"
+                    fastqs = None
+
+    return i, fastqs, error
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog=PROGRAM,
@@ -410,7 +898,11 @@ def main():
         "query",
         metavar="ACCESSION",
         type=str,
-        help="ENA/SRA accession to query. (Study, Experiment, or " "Run accession)",
+        nargs="?",
+        help=(
+            "ENA/SRA accession to query. (Study, Experiment, or Run accession), "
+            "not required with --accession-list"
+        ),
     )
     group1.add_argument(
         "provider",
@@ -453,6 +945,12 @@ def main():
         "--is_experiment", action="store_true", help="Query is an Experiment."
     )
     group3.add_argument("--is_run", action="store_true", help="Query is a Run.")
+    group3.add_argument(
+        "--accession-list",
+        metavar="FILE",
+        type=str,
+        help="A file of ENA/SRA accessions to query, one per line.",
+    )
     group3.add_argument(
         "--group_by_experiment",
         action="store_true",
@@ -490,9 +988,46 @@ def main():
         metavar="INT",
         type=int,
         default=1,
-        help="Total cpus used for downloading from SRA [default: %(default)d]",
+        help=(
+            "Total cpus used for downloading from SRA, shared between parallel "
+            "downloads [default: %(default)d]"
+        ),
+    )
+    group4.add_argument(
+        "--parallel-downloads",
+        metavar="INT",
+        type=int,
+        default=1,
+        help=(
+            "Number of runs to download at the same time, keep this modest (e.g. "
+            "4-8) to avoid being throttled [default: %(default)d]"
+        ),
+    )
+    group4.add_argument(
+        "--ignore-cache",
+        action="store_true",
+        help="Always query ENA, instead of reusing results from the last day.",
+    )
+    group4.add_argument(
+        "--ftp-connections",
+        metavar="INT",
+        type=int,
+        default=4,
+        help=(
+            "Number of connections used for each FTP download. Uses aria2c if it "
+            "is available (max 16 connections), otherwise byte ranges are "
+            "downloaded over HTTPS, falling back on a single FTP stream "
+            "[default: %(default)d]"
+        ),
+    )
+    group4.add_argument(
+        "--ftp_only",
+        action="store_true",
+        help=(
+            "FTP only downloads, from ENA's FTP server (over HTTPS when "
+            "--ftp-connections is above 1)."
+        ),
     )
-    group4.add_argument("--ftp_only", action="store_true", help="FTP only downloads.")
     group4.add_argument(
         "--sra_only",
         action="store_true",
@@ -525,6 +1060,15 @@ def main():
         sys.exit(0)
 
     args = parser.parse_args()
+    if args.accession_list:
+        if args.query and args.query.lower() in ["sra", "ena"]:
+            # Only the provider was given, it was parsed as the accession
+            args.provider = args.query.lower()
+            args.query = None
+        if args.query:
+            parser.error("ACCESSION and --accession-list cannot be used together")
+    elif not args.query:
+        parser.error("ACCESSION or --accession-list is required")
 
     # Setup logs
     FORMAT = "%(asctime)s:%(name)s:%(levelname)s - %(message)s"
@@ -534,6 +1078,13 @@ def main():
     )
     logging.getLogger().setLevel(set_log_level(args.silent, args.verbose))
 
+    if args.parallel_downloads < 1:
+        logging.error("--parallel-downloads must be at least 1")
+        sys.exit(1)
+    elif args.ftp_connections < 1:
+        logging.error("--ftp-connections must be at least 1")
+        sys.exit(1)
+
     aspera = (
         check_aspera(args.aspera, args.aspera_key, args.aspera_speed)
         if args.aspera
@@ -543,83 +1094,68 @@ def main():
         if args.provider == "ena":
             logging.info("Aspera Connect not available, using FTP for ENA downloads")
         args.ftp_only = True
+    args.aria2c = shutil.which("aria2c")
+    if args.aria2c:
+        logging.debug(f"Using {args.aria2c} for FTP downloads")
 
     outdir = os.getcwd() if args.outdir == "./" else f"{args.outdir}"
-    query = parse_query(args.query, args.is_study, args.is_experiment, args.is_run)
+    accessions = (
+        read_accession_list(args.accession_list)
+        if args.accession_list
+        else [args.query]
+    )
+    queries = [
+        parse_query(accession, args.is_study, args.is_experiment, args.is_run)
+        for accession in accessions
+    ]
 
     # Start Download Process
-    success, ena_data = get_run_info(query)
-    if not success:
-        logging.error("There was an issue querying ENA, exiting...")
-        logging.error(f"STATUS: {ena_data[0]}")
-        logging.error(f"TEXT: {ena_data[1]}")
-        sys.exit(1)
-
-    logging.info(f"Query: {args.query}")
+    ena_data = []
+    run_accessions = set()
+    with ThreadPoolExecutor(max_workers=args.parallel_downloads) as executor:
+        responses = executor.map(
+            lambda query: get_run_info(query, use_cache=not args.ignore_cache),
+            queries,
+        )
+        for success, data in responses:
+            if not success:
+                logging.error("There was an issue querying ENA, exiting...")
+                logging.error(f"STATUS: {data[0]}")
+                logging.error(f"TEXT: {data[1]}")
+                sys.exit(1)
+
+            # The same run can fall under more than one of the accessions
+            for run_info in data:
+                if run_info["run_accession"] not in run_accessions:
+                    run_accessions.add(run_info["run_accession"])
+                    ena_data.append(run_info)
+
+    logging.info(f"Query: {args.accession_list or args.query}")
     logging.info(f"Archive: {args.provider}")
     logging.info(f"Total Runs To Download: {len(ena_data)}")
     runs = {} if args.group_by_experiment or args.group_by_sample else None
-    for i, run_info in enumerate(ena_data):
-        run_acc = run_info["run_accession"]
-        logging.info(f"\tWorking on run {run_acc}...")
-        fastqs = None
-        if args.provider == "ena":
-            fastqs = ena_download(
-                run_info,
-                outdir,
-                aspera=aspera,
-                max_attempts=args.max_attempts,
-                ftp_only=args.ftp_only,
-            )
-
-            if fastqs == ENA_FAILED:
-                if args.only_provider:
-                    logging.error(f"\tNo fastqs found in ENA for {run_acc}")
-                    ena_data[i]["error"] = ENA_FAILED
-                    fastqs = None
-                else:
-                    # Retry download from SRA
-                    logging.info(f"\t{run_acc} not found on ENA, retrying from SRA")
-
-                    fastqs = sra_download(
-                        run_acc,
-                        outdir,
-                        cpus=args.cpus,
-                        max_attempts=args.max_attempts,
-                    )
-                    if fastqs == SRA_FAILED:
-                        logging.error(f"\t{run_acc} not found on SRA")
-                        ena_data[i]["error"] = f"{ENA_FAILED}&{SRA_FAILED}"
-                        fastqs = None
-
-        else:
-            fastqs = sra_download(
-                run_acc,
-                outdir,
-                cpus=args.cpus,
-                max_attempts=args.max_attempts,
-            )
-            if fastqs == SRA_FAILED:
-                if args.sra_only or args.only_provider:
-                    logging.error(f"\t{run_acc} not found on SRA")
-                    ena_data[i]["error"] = SRA_FAILED
-                    fastqs = None
-                else:
-                    # Retry download from ENA
-                    logging.info(f"\t{run_acc} not found on SRA, retrying from ENA")
-                    fastqs = ena_download(
-                        run_info,
-                        outdir,
-                        aspera=aspera,
-                        max_attempts=args.max_attempts,
-                        ftp_only=args.ftp_only,
-                    )
-                    if fastqs == ENA_FAILED:
-                        logging.error(f"\tNo fastqs found in ENA for {run_acc}")
-                        ena_data[i]["error"] = f"{SRA_FAILED}&{ENA_FAILED}"
-                        fastqs = None
-
-        # Add the download results
+    results = [None] * len(ena_data)
+    # Files from previous attempts, each run only ever writes its own files
+    existing = list_files(outdir)
+    with ThreadPoolExecutor(max_workers=args.parallel_downloads) as executor:
+        futures = [
+            executor.submit(process_run, i, run_info, args, aspera, outdir, existing)
+            for i, run_info in enumerate(ena_data)
+        ]
+        try:
+            for future in as_completed(futures):
+                i, fastqs, error = future.result()
+                results[i] = fastqs
+                if error:
+                    ena_data[i]["error"] = error
+        except BaseException:
+            # Stop on the first failed run, don't start the runs still queued
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Add the download results, in the original order of the runs
+    for run_info, fastqs in zip(ena_data, results):
         if fastqs:
             if args.group_by_experiment or args.group_by_sample:
                 name = run_info["sample_accession"]